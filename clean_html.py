@@ -6,72 +6,112 @@
 #   - Any ancestor <div> of a removed <svg> if that <div> becomes empty.
 #   - All other <div> elements that contain no visible text or meaningful content.
 #
+# The file is parsed incrementally and each element is cleaned as soon as it
+# has been fully parsed, in a single bottom-up pass.
+#
 # Usage:
 #   python clean_html.py input.html output.html
 
 import sys
-from bs4 import BeautifulSoup
+import lxml.html
+from lxml import etree
+
+SVG_TAGS = frozenset(('svg', 'path'))
+CLEANED_TAGS = ('svg', 'path', 'div')
+READ_CHUNK_SIZE = 64 * 1024
 
 def has_text_or_non_svg(el):
     """
-    Check whether the element or any of its descendants contain non-whitespace text
-    or tags other than <svg> or <path>.
+    Check whether the element contains any non-whitespace text outside of <svg>
+    or <path> elements. Returns as soon as the first such text is found.
     """
-    if el.name == 'svg' or el.name == 'path':
+    if el.tag in SVG_TAGS:
         return False
 
-    # Check for text directly in the element
-    if el.string and el.string.strip():
+    # Text directly inside the element, before its first child
+    if el.text and el.text.strip() and isinstance(el.tag, str):
         return True
 
-    # Check for any text or meaningful content in descendants
-    for desc in el.descendants:
-        if desc.name not in ['svg', 'path']:
-            # If the descendant has text content that's not just whitespace
-            if getattr(desc, 'string', None) and desc.string.strip():
-                return True
+    # Recurse into children; text following a child belongs to this element
+    for child in el:
+        if has_text_or_non_svg(child):
+            return True
+        if child.tail and child.tail.strip():
+            return True
 
     return False
 
-def remove_empty_divs(soup):
+def clean_element(el, nonempty):
     """
-    Remove all <div> elements that contain no meaningful content (non-whitespace text
-    or non-SVG/non-path children).
+    Remove an <svg> or <path> element, or a <div> with no meaningful content
+    (non-whitespace text outside of SVG/path elements). Its descendants must
+    already have been cleaned, so divs emptied by removed SVGs go too.
+
+    nonempty holds divs already known to have content because a div inside
+    them was kept; those are kept without scanning their subtree again.
     """
-    for div in soup.find_all('div'):
-        if not has_text_or_non_svg(div):
-            div.decompose()  # Delete the div if it's empty
+    if el.tag in SVG_TAGS:
+        el.drop_tree()  # Delete the element, keeping any text that follows it
+        return
 
-def remove_svgs(soup):
+    if el in nonempty:
+        nonempty.discard(el)
+    elif not has_text_or_non_svg(el):
+        el.drop_tree()
+        return
+
+    # This div is kept, so its nearest enclosing div has content too, unless
+    # an <svg>/<path> lies between them: that will be dropped with this div
+    for ancestor in el.iterancestors():
+        if ancestor.tag in SVG_TAGS:
+            break
+        if ancestor.tag == 'div':
+            nonempty.add(ancestor)
+            break
+
+def clean_tree(root):
     """
-    Remove all <svg> elements, and also remove their parent <div> if it becomes empty
-    after the SVG is removed.
+    Clean a parsed lxml HTML tree in place by removing <svg> elements and empty
+    <div>s, and return its root.
     """
-    for svg in soup.find_all('svg'):
-        parent = svg.find_parent('div')  # Get the closest ancestor <div>
-        svg.decompose()  # Remove the <svg> element
-
-        # If the parent <div> is now empty of text or other content, remove it too
-        if parent and not has_text_or_non_svg(parent):
-            parent.decompose()
+    # Reverse document order visits every element after its descendants
+    nonempty = set()
+    for el in reversed(list(root.iter(*CLEANED_TAGS))):
+        clean_element(el, nonempty)
+    return root
 
 def clean_html(input_path, output_path):
     """
-    Load HTML from input_path, clean it by removing <svg> elements and empty <div>s,
-    and write the cleaned HTML to output_path.
+    Parse HTML from input_path incrementally, clean each <svg>, <path> and <div>
+    as soon as it is closed, and write the cleaned HTML to output_path.
     """
-    with open(input_path, 'r', encoding='utf-8') as f:
-        soup = BeautifulSoup(f, 'lxml')  # if you want to use lxml explicitly
+    parser = etree.HTMLPullParser(
+        events=('end',), tag=CLEANED_TAGS, encoding='utf-8', default_doctype=False
+    )
+    parser.set_element_class_lookup(lxml.html.HtmlElementClassLookup())
 
-    # First remove <svg> elements and possibly their empty parents
-    remove_svgs(soup)
+    # An element is cleaned only once the next one has closed: by then the
+    # parser has moved past its tail text, so dropping it cannot race the parse.
+    pending = None
+    nonempty = set()
+    def clean_ready(events):
+        nonlocal pending
+        for _, el in events:
+            if pending is not None:
+                clean_element(pending, nonempty)
+            pending = el
 
-    # Then remove any other empty <div> elements
-    remove_empty_divs(soup)
+    with open(input_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(READ_CHUNK_SIZE), b''):
+            parser.feed(chunk)
+            clean_ready(parser.read_events())
+    root = parser.close()
+    clean_ready(parser.read_events())
+    if pending is not None:
+        clean_element(pending, nonempty)
 
     # Write the cleaned HTML to output file
-    with open(output_path, 'w', encoding='utf-8') as f:
-        f.write(str(soup))
+    root.getroottree().write(output_path, encoding='utf-8', method='html')
 
 if __name__ == '__main__':
     # Ensure the script is called with exactly two arguments
@@ -6,22 +6,35 @@
 # It performs the following transformations:
 #   - Inserts a visible comma between adjacent footnote markers.
 #   - Replaces raw URL footnotes (e.g., [^1]: http://example.com) with
-#     Markdown links including the page or PDF title.
+#     Markdown links including the page or PDF title. Titles are fetched
+#     concurrently, once per distinct URL.
 #   - Logs any errors encountered when fetching URLs.
+#   - Caches retrieved titles on disk so re-runs skip URLs already fetched.
 #   - Optionally uses Cloudscraper to bypass Cloudflare protections.
 #
 # Usage:
 #   python script.py input.md output.md [--debug] [--cloudscraper]
+#                    [--max-age SECONDS]
 # -----------------------------------------------------------------------------
 
 import sys
 import re
+import time
+import sqlite3
+import logging
+import threading
 import requests
 import cloudscraper
-from bs4 import BeautifulSoup
-from PyPDF2 import PdfReader
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from lxml import etree, html as lxml_html
+from tqdm import tqdm
+from pypdf import PdfReader
 from io import BytesIO
 from datetime import datetime
+from itertools import zip_longest
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # --- Logging setup ---
 today = datetime.now()
@@ -29,94 +42,412 @@ date_str = today.strftime('%Y-%m-%d')
 time_str = today.strftime('%Y-%m-%d-%H-%M')
 error_log_path = f"errors-{time_str}.txt"
 error_count = 0
+error_log = None
 comma_count = 0
 footnote_count = 0
 processed_links = 0
+counter_lock = threading.Lock()
+
+# --- Markdown patterns ---
+# Matches a footnote marker directly followed by another: the [^1] in [^1][^2].
+# The next marker is only looked ahead at, so runs like [^1][^2][^3] match twice.
+ADJACENT_FOOTNOTES_RE = re.compile(r'(\[\^[^\]\n]+\])(?=\[\^)')
+# A complete footnote marker directly followed by another: the [^1] in [^1][^2]
+MARKER_BEFORE_MARKER_RE = re.compile(r'\[\^[^\[\]\s]+\](?=\[\^)')
+# Matches: [^label]: http(s)://example.com
+URL_FOOTNOTE_RE = re.compile(r'\[\^(.+?)\]:\s+(https?://\S+)')
+# Either of the above in a single scan: URL footnotes are tried first
+# (groups 1-2), then adjacent markers (group 3)
+FOOTNOTE_RE = re.compile(f'{URL_FOOTNOTE_RE.pattern}|{ADJACENT_FOOTNOTES_RE.pattern}')
+
+# --- Fetch setup ---
+max_workers = 50
+# At most this many requests are in flight to any one host at a time
+max_per_host = 2
+host_semaphores = {}
+host_semaphores_lock = threading.Lock()
+# HEAD statuses that mean the URL is gone, so no GET is made
+head_gone_statuses = {404, 410}
+
+# Connections kept per pool, and retries for failed connections. Read
+# timeouts are not retried, so a host that never responds fails after one.
+pool_size = 64
+fetch_retry = Retry(total=3, read=0, backoff_factor=0.3)
+
+# Mount a pooled, retrying adapter so connections to the same host are reused
+def mount_adapters(sess):
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=fetch_retry)
+    sess.mount('http://', adapter)
+    sess.mount('https://', adapter)
+    return sess
+
+session = mount_adapters(requests.Session())
+
+# Create a cloudscraper session with the same pooling and retries. Its own
+# https adapter (browser cipher suite and ECDH curve) and browser headers are
+# kept; only its pool and retry settings are changed.
+def create_scraper():
+    sess = cloudscraper.create_scraper()
+    https_adapter = sess.adapters['https://']
+    https_adapter.max_retries = fetch_retry
+    https_adapter.init_poolmanager(pool_size, pool_size)
+    sess.mount('http://', HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                                      max_retries=fetch_retry))
+    return sess
+
+# HTML pages are only read up to the closing </title> tag, or this many bytes
+html_head_limit = 64 * 1024
+TITLE_END_RE = re.compile(rb'</title\s*>', re.I)
+# Titles of Cloudflare/bot-protection interstitials rather than the real page
+BOT_TITLE_RE = re.compile(r'^(?:verifying if your connection|just a moment)|cloudflare', re.I)
+
+# PDFs larger than pdf_size_limit are skipped. For large PDFs only the first
+# pdf_head_size and last pdf_tail_size bytes are fetched at first, since the
+# trailer, xref and (usually) the Info dictionary live there.
+pdf_size_limit = 50_000_000
+pdf_head_size = 1024 * 1024
+pdf_tail_size = 64 * 1024
+# Partial reads make pypdf warn about objects in the skipped middle
+logging.getLogger('pypdf').setLevel(logging.ERROR)
+
+# --- Title cache setup ---
+cache_path = "footnote_cache.sqlite"
+cache_max_age = 172800  # seconds; entries older than this are refetched
+cache_conn = None
+cache_lock = threading.Lock()
 
 debug_mode = False
 use_cloudscraper = False
 scraper = None
 
-# Log a message to console, optionally only in debug mode
+# Log a message to console in debug mode; otherwise progress is shown by
+# the progress bar in process_markdown
 def log(msg):
     if debug_mode:
         print(msg)
-    else:
-        print(f"Processed footnotes: {footnote_count}, links: {processed_links}, errors: {error_count}\r", end="")
 
-# Fetch and return the title of a webpage or PDF given a URL.
-# If an error occurs, log it and return a placeholder title.
-def get_title_from_url(url, original_footnote):
-    global error_count
-    log(f"Fetching title for URL: {url}")
+# Count an error and append it to the error log. The log is opened on the
+# first error and kept open (line-buffered) until close_error_log is called.
+def record_error(message, original_footnote):
+    global error_count, error_log
+    with counter_lock:
+        error_count += 1
+        if error_log is None:
+            error_log = open(error_log_path, 'a', encoding='utf-8', buffering=1)
+        error_log.write(f"{message}\n")
+        error_log.write(f"Original footnote: {original_footnote}\n")
+    log(message)
+
+# Close the error log if any error was recorded
+def close_error_log():
+    global error_log
+    if error_log is not None:
+        error_log.close()
+        error_log = None
+
+# Open the on-disk title cache, creating its table on first use
+def open_cache():
+    global cache_conn
+    cache_conn = sqlite3.connect(cache_path, check_same_thread=False)
+    cache_conn.execute(
+        "CREATE TABLE IF NOT EXISTS titles ("
+        "url TEXT PRIMARY KEY, title TEXT NOT NULL, fetched_at REAL NOT NULL)"
+    )
+
+# Close the on-disk title cache, committing any stored titles
+def close_cache():
+    global cache_conn
+    if cache_conn is not None:
+        cache_conn.commit()
+        cache_conn.close()
+        cache_conn = None
+
+# Return the cached title for a URL, or None if missing or expired
+def cache_lookup(url):
+    if cache_conn is None:
+        return None
+    with cache_lock:
+        row = cache_conn.execute(
+            "SELECT title, fetched_at FROM titles WHERE url = ?", (url,)
+        ).fetchone()
+    if row is None or time.time() - row[1] > cache_max_age:
+        return None
+    return row[0]
+
+# Store a successfully retrieved title for a URL
+def cache_store(url, title):
+    if cache_conn is None:
+        return
+    with cache_lock:
+        cache_conn.execute(
+            "INSERT OR REPLACE INTO titles (url, title, fetched_at) VALUES (?, ?, ?)",
+            (url, title, time.time()),
+        )
+
+# Return the semaphore limiting concurrent requests to the URL's host
+def host_semaphore(url):
+    host = urlsplit(url).netloc.lower()
+    with host_semaphores_lock:
+        if host not in host_semaphores:
+            host_semaphores[host] = threading.BoundedSemaphore(max_per_host)
+        return host_semaphores[host]
+
+# Group URLs into slices that each contain at most one URL per host, taking
+# hosts round-robin. Submitting slices in order spreads work across hosts, so
+# few workers sit waiting on a busy host's semaphore.
+def host_slices(urls):
+    by_host = {}
+    for url in urls:
+        by_host.setdefault(urlsplit(url).netloc.lower(), []).append(url)
+    return [[url for url in row if url is not None] for row in zip_longest(*by_host.values())]
+
+# Read a streamed HTML response only as far as needed to see its <title>
+def read_html_head(response):
+    head = bytearray()
+    for chunk in response.iter_content(chunk_size=4096):
+        start = max(0, len(head) - 16)  # a tag may straddle two chunks
+        head += chunk
+        if TITLE_END_RE.search(head, start) or len(head) >= html_head_limit:
+            break
+    return bytes(head)
+
+# Seekable, read-only view of a file of known size of which only the head and
+# tail bytes were downloaded. Bytes in between read as zeros.
+class PartialFile:
+    def __init__(self, head, tail, size):
+        self.head = head
+        self.tail = tail
+        self.size = size
+        self.tail_start = size - len(tail)
+        self.pos = 0
+
+    def seek(self, offset, whence=0):
+        base = {0: 0, 1: self.pos, 2: self.size}[whence]
+        self.pos = max(0, base + offset)
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+    def read(self, n=-1):
+        end = self.size if n is None or n < 0 else min(self.size, self.pos + n)
+        out = bytearray()
+        pos = self.pos
+        if pos < len(self.head):
+            out += self.head[pos:end]
+            pos += len(out)
+        gap_end = min(end, self.tail_start)
+        if pos < gap_end:
+            out += bytes(gap_end - pos)
+            pos = gap_end
+        if pos < end:
+            out += self.tail[pos - self.tail_start:end - self.tail_start]
+        self.pos = max(self.pos, end)
+        return bytes(out)
+
+# Return the title from a PDF's metadata, or None if it has none
+def pdf_metadata_title(stream):
+    metadata = PdfReader(stream).metadata
+    return metadata.title if metadata else None
+
+# Fetch the last pdf_tail_size bytes of a URL with a Range request,
+# or None if the server does not honour it
+def fetch_pdf_tail(client, url, headers):
+    range_headers = dict(headers, Range=f'bytes=-{pdf_tail_size}')
+    with client.get(url, headers=range_headers, timeout=10, stream=True) as response:
+        if response.status_code != 206:
+            return None
+        return response.content
+
+# Read the title of a streamed PDF response, downloading as little as possible:
+# first try the head and tail of the file, then fall back to the full body.
+def read_pdf_title(response, client, url, headers):
+    size = int(response.headers.get('Content-Length') or 0)
+    if size > pdf_size_limit:
+        return 'Large PDF (title skipped)'
+
+    chunks = response.iter_content(chunk_size=64 * 1024)
+    data = bytearray()
+    for chunk in chunks:
+        data += chunk
+        if len(data) >= pdf_head_size:
+            break
+
+    if size > len(data) + pdf_tail_size:
+        tail = fetch_pdf_tail(client, url, headers)
+        if tail is not None and len(tail) == pdf_tail_size:
+            try:
+                title = pdf_metadata_title(PartialFile(bytes(data), tail, size))
+            except Exception as e:
+                log(f"Partial PDF read failed for {url}: {e}")
+                title = None
+            if title:
+                return title
+
+    for chunk in chunks:
+        data += chunk
+        if len(data) > pdf_size_limit:
+            return 'Large PDF (title skipped)'
+    return pdf_metadata_title(BytesIO(data)) or 'Untitled PDF'
+
+# Extract the first <title> from raw HTML bytes with lxml's C parser.
+# The header charset, when given, overrides any <meta charset> in the page.
+def parse_html_title(head, encoding=None):
+    if not head.strip():
+        return 'Untitled Webpage'
+    try:
+        root = lxml_html.fromstring(head, parser=lxml_html.HTMLParser(encoding=encoding))
+    except etree.ParserError:  # e.g. only a doctype or a comment
+        return 'Untitled Webpage'
+    return root.xpath('string((//title)[1])').strip() or 'Untitled Webpage'
+
+# Fetch the title of a webpage or PDF given a URL. Returns (title, error),
+# where error is a message to log, or None on success. Logging and caching
+# are left to get_title_from_url.
+# A HEAD request is made first, through the plain session, so URLs that are
+# gone (404/410) or clearly neither HTML nor PDF are reported without a GET.
+# Any other HEAD outcome goes on to the GET: many servers reject HEAD, and
+# Cloudflare challenges (never 2xx, 404 or 410) are solved from a GET body.
+def fetch_title(url):
     try:
         headers = {'User-Agent': 'Mozilla/5.0'}
-        response = scraper.get(url, headers=headers, timeout=10) if use_cloudscraper else requests.get(url, headers=headers, timeout=10)
-        content_type = response.headers.get('Content-Type', '')
-        log(f"Content-Type: {content_type}")
-
-        if 'application/pdf' in content_type:
-            reader = PdfReader(BytesIO(response.content))
-            title = reader.metadata.title or 'Untitled PDF'
-        elif 'text/html' in content_type:
-            soup = BeautifulSoup(response.text, 'html.parser')
-            title_tag = soup.find('title')
-            title = title_tag.text.strip() if title_tag else 'Untitled Webpage'
-            if title.lower().startswith("verifying if your connection") or "cloudflare" in title.lower():
-                raise ValueError("Bot protection page detected")
-        else:
-            error_count += 1
-            with open(error_log_path, 'a', encoding='utf-8') as logf:
-                logf.write(f"Unknown content type for URL {url}: {content_type}\n")
-                logf.write(f"Original footnote: {original_footnote}\n")
-            log(f"Unknown content type for URL {url}")
-            return 'Unknown Resource'
-
-        if title.strip().lower() == "verifying if your connection is secure...":
-            raise ValueError("Detected bot protection title")
+        client = scraper if use_cloudscraper else session
+        try:
+            probe = session.head(url, headers=headers, allow_redirects=True, timeout=5)
+        except requests.RequestException as e:  # e.g. timed out; the GET decides
+            log(f"HEAD failed for {url}: {e}")
+            probe = None
+        if probe is not None and probe.status_code in head_gone_statuses:
+            return "Error retrieving title", f"HTTP {probe.status_code} for URL {url}"
+        content_type = probe.headers.get('Content-Type', '') if probe is not None and probe.ok else ''
+        if content_type and 'application/pdf' not in content_type and 'text/html' not in content_type:
+            return 'Unknown Resource', f"Unknown content type for URL {url}: {content_type}"
 
-        log(f"Retrieved title: {title}")
-        return title
+        with client.get(url, headers=headers, timeout=10, stream=True) as response:
+            # Error pages have titles too, but they must not be used or cached
+            if not response.ok:
+                return "Error retrieving title", f"HTTP {response.status_code} for URL {url}"
+            content_type = response.headers.get('Content-Type', '')
+            log(f"Content-Type: {content_type}")
+
+            if 'application/pdf' in content_type:
+                title = read_pdf_title(response, client, url, headers)
+            elif 'text/html' in content_type:
+                head = read_html_head(response)
+                title = parse_html_title(head, response.encoding if 'charset' in content_type else None)
+                if BOT_TITLE_RE.search(title):
+                    raise ValueError("Bot protection page detected")
+            else:
+                return 'Unknown Resource', f"Unknown content type for URL {url}: {content_type}"
+
+        return title, None
     except Exception as e:
-        error_count += 1
-        with open(error_log_path, 'a', encoding='utf-8') as logf:
-            logf.write(f"Error retrieving title from {url}: {e}\n")
-            logf.write(f"Original footnote: {original_footnote}\n")
-        log(f"Error retrieving title from {url}: {e}")
-        return "Error retrieving title"
+        return "Error retrieving title", f"Error retrieving title from {url}: {e}"
+
+# Return the title of a webpage or PDF given a URL.
+# Titles are served from the on-disk cache when a fresh entry exists.
+# If an error occurs, log it and return a placeholder title.
+def get_title_from_url(url, original_footnote):
+    cached = cache_lookup(url)
+    if cached is not None:
+        log(f"Cached title for URL: {url}")
+        return cached
+
+    log(f"Fetching title for URL: {url}")
+    with host_semaphore(url):
+        title, error = fetch_title(url)
+    if error:
+        record_error(error, original_footnote)
+    else:
+        log(f"Retrieved title: {title}")
+        cache_store(url, title)
+    return title
 
 # Process a Markdown file:
 # - Inserts commas between adjacent footnote markers.
 # - Replaces URL footnotes with titled Markdown links.
 # - Writes output to a new file and prints summary statistics.
 def process_markdown(input_path, output_path):
-    global comma_count, footnote_count, processed_links
+    global comma_count
     log(f"Reading input file: {input_path}")
     with open(input_path, 'r', encoding='utf-8') as f:
         content = f.read()
 
     log("Original content loaded.")
 
-    # Step 1: Insert <sup>,</sup> between adjacent footnote markers
-    content, comma_count = re.subn(r'(\[\^.+?\])(\[\^)', r'\1<sup>,</sup>\2', content)
-    log(f"Inserted <sup>,</sup> between adjacent footnotes: {comma_count} replacements made.")
+    # Step 1: Insert <sup>,</sup> between adjacent footnote markers.
+    # When every "][^" in the text sits between two footnote markers, a plain
+    # str.replace does it now. Otherwise (e.g. "[link][^1]") the commas are
+    # inserted by the combined regex pass in step 3, alongside the URL footnotes.
+    boundaries = content.count('][^')
+    if boundaries == len(MARKER_BEFORE_MARKER_RE.findall(content)):
+        content = content.replace('][^', ']<sup>,</sup>[^')
+        comma_count = boundaries
+        footnote_pattern = URL_FOOTNOTE_RE
+        log(f"Inserted <sup>,</sup> between adjacent footnotes: {comma_count} replacements made.")
+    else:
+        comma_count = 0
+        footnote_pattern = FOOTNOTE_RE
+
+    # Step 2: Fetch titles for all URL footnotes concurrently. They are found
+    # with the same pattern step 3 substitutes with, so the matches line up.
+    footnotes = {}  # original footnote line -> (label, url)
+    for match in footnote_pattern.finditer(content):
+        if match.group(2) is not None:
+            footnotes[match.group(0)] = (match.group(1), match.group(2).strip())
+
+    pending = {}  # url -> first footnote citing it, for error reports
+    for original_footnote, (label, url) in footnotes.items():
+        pending.setdefault(url, original_footnote)
+
+    url_to_title = {}
+    open_cache()
+    try:
+        # Cached titles need no request, so they take no worker or host slot
+        for url in pending:
+            cached = cache_lookup(url)
+            if cached is not None:
+                url_to_title[url] = cached
+        slices = host_slices(url for url in pending if url not in url_to_title)
+        log(f"Fetching titles for {len(pending) - len(url_to_title)} URLs "
+            f"in {len(slices)} host slices with {max_workers} workers.")
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor, \
+                tqdm(total=len(pending), initial=len(url_to_title), desc="Fetching titles",
+                     unit="link", disable=debug_mode) as progress:
+            futures = {
+                executor.submit(get_title_from_url, url, pending[url]): url
+                for urls in slices for url in urls
+            }
+            for future in as_completed(futures):
+                url_to_title[futures[future]] = future.result()
+                progress.set_postfix(errors=error_count, refresh=False)
+                progress.update(1)
+    finally:
+        close_cache()
+        close_error_log()
+
+    # Step 3: Replace plain footnotes pointing directly to HTTP URLs, and
+    # insert any commas left from step 1, in a single pass
+    new_footnotes = {
+        original_footnote: f"[^{label}]: [{url_to_title[url]}]({url}) retrieved on {date_str}"
+        for original_footnote, (label, url) in footnotes.items()
+    }
 
-    # Step 2: Replace plain footnotes pointing directly to HTTP URLs
     def replace_footnote(match):
-        global footnote_count, processed_links
-        label = match.group(1)
-        url = match.group(2).strip()
-        original_footnote = match.group(0)
+        global comma_count, footnote_count, processed_links
+        if match.group(2) is None:
+            comma_count += 1
+            return f"{match.group(3)}<sup>,</sup>"
         footnote_count += 1
-        log(f"Processing footnote: [^{label}]: {url}")
-        title = get_title_from_url(url, original_footnote)
         processed_links += 1
-        new_footnote = f"[^{label}]: [{title}]({url}) retrieved on {date_str}"
+        new_footnote = new_footnotes[match.group(0)]
         log(f"Updated footnote: {new_footnote}")
         return new_footnote
 
-    # Matches: [^label]: http(s)://example.com
-    content, _ = re.subn(r'\[\^(.+?)\]:\s+(https?://\S+)', replace_footnote, content)
+    content = footnote_pattern.sub(replace_footnote, content)
+    if footnote_pattern is FOOTNOTE_RE:
+        log(f"Inserted <sup>,</sup> between adjacent footnotes: {comma_count} replacements made.")
 
     log(f"Writing output to: {output_path}")
     with open(output_path, 'w', encoding='utf-8') as f:
@@ -132,9 +463,19 @@ def process_markdown(input_path, output_path):
 
 # Entry point: handles argument parsing and triggers the main processing
 if __name__ == '__main__':
+    usage = "Usage: python script.py input.md output.md [--debug] [--cloudscraper] [--max-age SECONDS]"
     args = sys.argv[1:]
+    if '--max-age' in args:
+        i = args.index('--max-age')
+        try:
+            cache_max_age = int(args[i + 1])
+        except (IndexError, ValueError):
+            print(usage)
+            sys.exit(1)
+        del args[i:i + 2]
+
     if not (2 <= len(args) <= 4):
-        print("Usage: python script.py input.md output.md [--debug] [--cloudscraper]")
+        print(usage)
         sys.exit(1)
 
     input_file = args[0]
@@ -143,6 +484,6 @@ if __name__ == '__main__':
     use_cloudscraper = '--cloudscraper' in args
 
     if use_cloudscraper:
-        scraper = cloudscraper.create_scraper()
+        scraper = create_scraper()
 
     process_markdown(input_file, output_file)
\ No newline at end of file
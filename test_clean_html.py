@@ -2,20 +2,22 @@
 # Test Script: test_clean_html.py
 #
 # Purpose:
-# Unit tests for the `clean_html` function defined in `clean_html.py`.
+# Unit tests for the `clean_html` and `clean_tree` functions defined in
+# `clean_html.py`.
 # This function is used to preprocess HTML files by removing unwanted elements
 # (e.g. <svg> tags, empty divs) before converting to Markdown via Pandoc.
 #
 # This test suite verifies:
-#   - That in-memory HTML strings are cleaned as expected.
+#   - That in-memory HTML trees are cleaned as expected (no disk I/O).
 #   - That real HTML files (golden inputs) produce the expected cleaned output.
 # -----------------------------------------------------------------------------
 
 import unittest
 import tempfile
 import os
+import lxml.html
 from bs4 import BeautifulSoup
-from clean_html import clean_html
+from clean_html import clean_html, clean_tree, has_text_or_non_svg
 
 class TestCleanHtml(unittest.TestCase):
     def setUp(self):
@@ -44,28 +46,15 @@ class TestCleanHtml(unittest.TestCase):
     def normalize_html(self, html_str):
         return BeautifulSoup(html_str, 'html.parser').prettify()
 
-    # Test the clean_html function using in-memory file I/O (no disk fixtures)
+    # Test the clean_tree core on an in-memory tree (no disk I/O)
     def test_clean_html_memory(self):
-        with tempfile.NamedTemporaryFile(delete=False, mode='w+', suffix='.html') as infile:
-            infile.write(self.input_html)
-            infile.flush()
-            input_path = infile.name
-
-        with tempfile.NamedTemporaryFile(delete=False, mode='r+', suffix='.html') as outfile:
-            output_path = outfile.name
-
-        try:
-            clean_html(input_path, output_path)
-            with open(output_path, 'r', encoding='utf-8') as f:
-                result = f.read()
+        root = clean_tree(lxml.html.document_fromstring(self.input_html))
+        result = lxml.html.tostring(root, encoding='unicode')
 
-            self.assertEqual(
-                self.normalize_html(result),
-                self.normalize_html(self.expected_output_html)
-            )
-        finally:
-            os.remove(input_path)
-            os.remove(output_path)
+        self.assertEqual(
+            self.normalize_html(result),
+            self.normalize_html(self.expected_output_html)
+        )
 
     # Test the clean_html function against golden input/output files
     def test_clean_html_with_file_io(self):
@@ -93,6 +82,45 @@ class TestCleanHtml(unittest.TestCase):
         finally:
             os.remove(output_path)
 
+    # Text nested inside an <svg> does not count as visible content
+    def test_has_text_or_non_svg_ignores_svg_text(self):
+        root = lxml.html.fromstring(
+            '<div><div id="a"><svg><text>icon</text></svg></div>'
+            '<div id="b"><svg></svg><span> label </span></div></div>'
+        )
+        self.assertFalse(has_text_or_non_svg(root.get_element_by_id('a')))
+        self.assertTrue(has_text_or_non_svg(root.get_element_by_id('b')))
+
+    # A div holding only kept divs is kept without being rescanned, but not
+    # when the kept div sits inside an <svg> that is removed with it
+    def test_clean_tree_nested_divs(self):
+        root = clean_tree(lxml.html.document_fromstring(
+            '<div id="kept"><div><p>inner text</p></div></div>'
+            '<div id="outer"><svg><foreignObject><div>inner text</div>'
+            '</foreignObject></svg></div>'
+        ))
+        self.assertIsNotNone(root.find('.//div[@id="kept"]'))
+        self.assertIsNone(root.find('.//div[@id="outer"]'))
+
+    # The streaming path drops the same div when cleaning from a file
+    def test_clean_html_drops_div_around_svg_with_inner_div(self):
+        with tempfile.NamedTemporaryFile(delete=False, mode='w', suffix='.html') as infile:
+            infile.write(
+                '<html><body><div id="outer"><svg><foreignObject>'
+                '<div>inner text</div></foreignObject></svg></div></body></html>'
+            )
+            input_path = infile.name
+        output_path = input_path + '.out'
+
+        try:
+            clean_html(input_path, output_path)
+            with open(output_path, 'r', encoding='utf-8') as f:
+                self.assertNotIn('outer', f.read())
+        finally:
+            os.remove(input_path)
+            if os.path.exists(output_path):
+                os.remove(output_path)
+
 # Run tests from the command line if executed directly
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
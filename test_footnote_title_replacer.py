@@ -0,0 +1,296 @@
+# -----------------------------------------------------------------------------
+# Test Script: test_footnote_title_replacer.py
+#
+# Purpose:
+# Unit tests for the helpers in `footnote_title_replacer.py` that don't need
+# the network: partial PDF reads, per-host limits, footnote commas and the
+# on-disk title cache.
+#
+# This test suite verifies:
+#   - That PartialFile serves the head, a zero-filled gap and the tail.
+#   - That PDF titles are read from the head and tail when Range is honoured,
+#     from the full body when it isn't, and not at all past the size cap.
+#   - That every boundary in a run of footnote markers gets a comma, whether
+#     the str.replace fast path or the regex pass is taken.
+#   - That HTML titles are parsed from doctype-only pages and with the header
+#     charset, and that HTML reads stop at a </title> split across chunks.
+#   - That URLs are spread across hosts and no host gets more than
+#     max_per_host concurrent fetches.
+#   - That HEAD ends a fetch only on 404/410 or a clearly non-HTML/PDF type.
+#   - That cached titles expire and HTTP error pages are never cached.
+#   - That the cloudscraper session keeps its browser TLS adapter and headers.
+# -----------------------------------------------------------------------------
+
+import os
+import time
+import tempfile
+import threading
+import unittest
+import contextlib
+from io import BytesIO, StringIO
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+import cloudscraper
+from pypdf import PdfWriter
+import footnote_title_replacer as ftr
+
+# Stand-in for a streamed requests.Response that records how much was read
+class FakeResponse:
+    def __init__(self, body, status_code=200, headers=None):
+        self.body = body
+        self.status_code = status_code
+        self.headers = headers or {'Content-Length': str(len(body))}
+        self.ok = status_code < 400
+        self.bytes_read = 0
+
+    # Like a socket, hand back at most 256 bytes at a time
+    def iter_content(self, chunk_size=1):
+        chunk_size = min(chunk_size, 256)
+        for i in range(0, len(self.body), chunk_size):
+            chunk = self.body[i:i + chunk_size]
+            self.bytes_read += len(chunk)
+            yield chunk
+
+    @property
+    def content(self):
+        self.bytes_read = len(self.body)
+        return self.body
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+# Stand-in for a requests session serving one file, optionally honouring Range
+class FakeClient:
+    def __init__(self, body, honour_range=True, status_code=200, content_type='application/pdf',
+                 head_status=None, head_content_type=None, head_error=None):
+        self.body = body
+        self.honour_range = honour_range
+        self.status_code = status_code
+        self.content_type = content_type
+        self.head_status = head_status or status_code
+        self.head_content_type = head_content_type or content_type
+        self.head_error = head_error
+        self.requests = []
+        self.heads = 0
+
+    def head(self, url, **kwargs):
+        self.heads += 1
+        if self.head_error:
+            raise self.head_error
+        return FakeResponse(b'', self.head_status, {'Content-Type': self.head_content_type})
+
+    def get(self, url, headers=None, **kwargs):
+        self.requests.append(headers or {})
+        range_header = (headers or {}).get('Range')
+        if range_header and self.honour_range:
+            tail = self.body[-int(range_header.split('-')[-1]):]
+            return FakeResponse(tail, status_code=206)
+        return FakeResponse(self.body, self.status_code, {
+            'Content-Length': str(len(self.body)), 'Content-Type': self.content_type
+        })
+
+class TestFootnoteTitleReplacer(unittest.TestCase):
+    def setUp(self):
+        # A PDF with a title and an attachment padding out its middle
+        writer = PdfWriter()
+        writer.add_blank_page(100, 100)
+        writer.add_attachment('pad.bin', b'x' * 20000)
+        writer.add_metadata({'/Title': 'Test PDF'})
+        buffer = BytesIO()
+        writer.write(buffer)
+        self.pdf = buffer.getvalue()
+
+        # Shrink the head/tail sizes so the small PDF counts as "large"
+        patcher = mock.patch.multiple(ftr, pdf_head_size=1024, pdf_tail_size=1024)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    # Reads are served from the head, zeros in the gap, then the tail
+    def test_partial_file_reads_across_head_gap_and_tail(self):
+        f = ftr.PartialFile(b'HEAD', b'TAIL', 12)
+        self.assertEqual(f.read(), b'HEAD\0\0\0\0TAIL')
+        f.seek(2)
+        self.assertEqual(f.read(4), b'AD\0\0')
+        f.seek(-6, 2)
+        self.assertEqual(f.tell(), 6)
+        self.assertEqual(f.read(100), b'\0\0TAIL')
+        self.assertEqual(f.read(), b'')
+
+    # With Range support only the head and tail are downloaded
+    def test_read_pdf_title_from_head_and_tail(self):
+        response = FakeResponse(self.pdf)
+        client = FakeClient(self.pdf)
+        title = ftr.read_pdf_title(response, client, 'http://example.com/a.pdf', {})
+        self.assertEqual(title, 'Test PDF')
+        self.assertLess(response.bytes_read, len(self.pdf))
+        self.assertEqual(client.requests[0]['Range'], 'bytes=-1024')
+
+    # Without Range support the rest of the original stream is read instead
+    def test_read_pdf_title_without_range_support(self):
+        response = FakeResponse(self.pdf)
+        client = FakeClient(self.pdf, honour_range=False)
+        title = ftr.read_pdf_title(response, client, 'http://example.com/a.pdf', {})
+        self.assertEqual(title, 'Test PDF')
+        self.assertEqual(response.bytes_read, len(self.pdf))
+
+    # PDFs over the size cap are skipped without reading the body
+    def test_read_pdf_title_skips_oversized_pdf(self):
+        response = FakeResponse(self.pdf, headers={'Content-Length': str(ftr.pdf_size_limit + 1)})
+        client = FakeClient(self.pdf)
+        title = ftr.read_pdf_title(response, client, 'http://example.com/a.pdf', {})
+        self.assertEqual(title, 'Large PDF (title skipped)')
+        self.assertEqual(response.bytes_read, 0)
+        self.assertEqual(client.requests, [])
+
+    # A HEAD 404 or 410 is final, with no GET, also when cloudscraper does GETs
+    def test_fetch_title_head_gone(self):
+        for status in (404, 410):
+            client = FakeClient(b'<title>Not Found</title>', status_code=status, content_type='text/html')
+            scraper = FakeClient(b'<title>Not Found</title>', content_type='text/html')
+            with mock.patch.multiple(ftr, session=client, scraper=scraper, use_cloudscraper=True):
+                title, error = ftr.fetch_title('http://example.com/missing.html')
+            self.assertEqual(title, 'Error retrieving title')
+            self.assertIn(f'HTTP {status}', error)
+            self.assertEqual(client.heads, 1)
+            self.assertEqual(client.requests + scraper.requests, [])
+
+    # A successful HEAD that is neither HTML nor PDF skips the GET
+    def test_fetch_title_head_unknown_content_type(self):
+        client = FakeClient(b'', content_type='image/png')
+        with mock.patch.object(ftr, 'session', client):
+            title, error = ftr.fetch_title('http://example.com/a.png')
+        self.assertEqual(title, 'Unknown Resource')
+        self.assertIn('image/png', error)
+        self.assertEqual(client.requests, [])
+
+    # Other HEAD failures, such as 405, a 403 challenge or an exception, go on to the GET
+    def test_fetch_title_head_failure_falls_through_to_get(self):
+        for kwargs in ({'head_status': 405, 'head_content_type': 'image/png'},
+                       {'head_status': 403},
+                       {'head_error': ftr.requests.ConnectionError('read timed out')}):
+            client = FakeClient(b'<title>Page</title>', content_type='text/html', **kwargs)
+            with mock.patch.object(ftr, 'session', client):
+                self.assertEqual(ftr.fetch_title('http://example.com/'), ('Page', None))
+            self.assertEqual(len(client.requests), 1)
+
+    # Pages with only a doctype or a comment have no tree, so no title
+    def test_parse_html_title_without_elements(self):
+        self.assertEqual(ftr.parse_html_title(b'<!DOCTYPE html>'), 'Untitled Webpage')
+        self.assertEqual(ftr.parse_html_title(b'<!-- nothing here -->'), 'Untitled Webpage')
+
+    # The charset from the Content-Type header wins over <meta charset>
+    def test_parse_html_title_header_charset_overrides_meta(self):
+        head = '<head><meta charset="iso-8859-1"><title>Café</title></head>'.encode('utf-8')
+        self.assertEqual(ftr.parse_html_title(head, 'utf-8'), 'Café')
+        self.assertEqual(ftr.parse_html_title(head), 'CafÃ©')
+
+    # Reading stops at the chunk completing </title>, even if split across two
+    def test_read_html_head_stops_at_split_title_end(self):
+        body = b'<title>' + b'x' * 245 + b'</title>' + b'y' * 4096
+        self.assertEqual(body[252:256], b'</ti')
+        response = FakeResponse(body)
+        self.assertEqual(ftr.read_html_head(response), body[:512])
+        self.assertEqual(response.bytes_read, 512)
+
+    # Each slice holds at most one URL per host, hosts taken round-robin
+    def test_host_slices(self):
+        urls = ['http://a.com/1', 'http://a.com/2', 'http://b.com/1', 'http://A.com/3']
+        self.assertEqual(ftr.host_slices(urls), [
+            ['http://a.com/1', 'http://b.com/1'],
+            ['http://a.com/2'],
+            ['http://A.com/3'],
+        ])
+
+    # Concurrent fetches to one host never exceed max_per_host
+    def test_fetches_are_limited_per_host(self):
+        in_flight = {'a.com': 0, 'b.com': 0}
+        peak = {'a.com': 0, 'b.com': 0}
+        lock = threading.Lock()
+
+        def fake_fetch_title(url):
+            host = url.split('/')[2]
+            with lock:
+                in_flight[host] += 1
+                peak[host] = max(peak[host], in_flight[host])
+            time.sleep(0.01)
+            with lock:
+                in_flight[host] -= 1
+            return 'Title', None
+
+        urls = [f'http://{host}/{i}' for host in ('a.com', 'b.com') for i in range(10)]
+        with mock.patch.object(ftr, 'fetch_title', fake_fetch_title), \
+                mock.patch.object(ftr, 'host_semaphores', {}), \
+                ThreadPoolExecutor(max_workers=20) as executor:
+            list(executor.map(lambda url: ftr.get_title_from_url(url, ''), urls))
+        self.assertEqual(peak, {'a.com': ftr.max_per_host, 'b.com': ftr.max_per_host})
+
+    # Run process_markdown on text without URL footnotes and return its output
+    def process(self, text):
+        with tempfile.TemporaryDirectory() as tmp:
+            input_path = os.path.join(tmp, 'in.md')
+            output_path = os.path.join(tmp, 'out.md')
+            with open(input_path, 'w', encoding='utf-8') as f:
+                f.write(text)
+            with mock.patch.object(ftr, 'cache_path', ':memory:'), \
+                    contextlib.redirect_stdout(StringIO()), contextlib.redirect_stderr(StringIO()):
+                ftr.process_markdown(input_path, output_path)
+            with open(output_path, 'r', encoding='utf-8') as f:
+                return f.read()
+
+    # Every boundary in a run of three markers gets a comma on the fast path
+    def test_comma_run_of_three_markers(self):
+        self.assertEqual(
+            self.process('A[^1][^2][^3] B\n'),
+            'A[^1]<sup>,</sup>[^2]<sup>,</sup>[^3] B\n'
+        )
+        self.assertEqual(ftr.comma_count, 2)
+
+    # The regex pass, taken when a "][^" isn't a marker pair, agrees with it
+    def test_comma_run_of_three_markers_with_link_reference(self):
+        self.assertEqual(
+            self.process('A[^1][^2][^3] B\nSee [link][^4].\n'),
+            'A[^1]<sup>,</sup>[^2]<sup>,</sup>[^3] B\nSee [link][^4].\n'
+        )
+        self.assertEqual(ftr.comma_count, 2)
+
+    # Cached titles are returned until they are older than cache_max_age
+    def test_cache_entries_expire(self):
+        with mock.patch.object(ftr, 'cache_path', ':memory:'):
+            ftr.open_cache()
+            self.addCleanup(ftr.close_cache)
+            with mock.patch.object(ftr.time, 'time', return_value=1000.0):
+                ftr.cache_store('http://example.com/', 'Example')
+            with mock.patch.object(ftr.time, 'time', return_value=1000.0 + ftr.cache_max_age):
+                self.assertEqual(ftr.cache_lookup('http://example.com/'), 'Example')
+            with mock.patch.object(ftr.time, 'time', return_value=1001.0 + ftr.cache_max_age):
+                self.assertIsNone(ftr.cache_lookup('http://example.com/'))
+
+    # An HTTP error page is reported as an error, not cached as a title
+    def test_error_pages_are_not_cached(self):
+        client = FakeClient(b'<title>Error response</title>', status_code=500, content_type='text/html')
+        with mock.patch.object(ftr, 'cache_path', ':memory:'), \
+                mock.patch.object(ftr, 'session', client), \
+                mock.patch.object(ftr, 'record_error') as record_error:
+            ftr.open_cache()
+            self.addCleanup(ftr.close_cache)
+            title = ftr.get_title_from_url('http://example.com/', '')
+            self.assertIsNone(ftr.cache_lookup('http://example.com/'))
+        self.assertEqual(title, 'Error retrieving title')
+        self.assertIn('HTTP 500', record_error.call_args[0][0])
+
+    # The scraper keeps its browser TLS adapter and headers, with our pooling
+    def test_create_scraper_keeps_browser_profile(self):
+        scraper = ftr.create_scraper()
+        self.addCleanup(scraper.close)
+        https_adapter = scraper.adapters['https://']
+        self.assertIsInstance(https_adapter, cloudscraper.CipherSuiteAdapter)
+        self.assertIs(https_adapter.max_retries, ftr.fetch_retry)
+        self.assertEqual(https_adapter._pool_maxsize, ftr.pool_size)
+        self.assertNotIn('python-requests', scraper.headers['User-Agent'])
+
+# Run tests from the command line if executed directly
+if __name__ == '__main__':
+    unittest.main()